@@ -1,22 +1,85 @@
 import gradio as gr
-import requests
+import httpx
+import asyncio
 import os
 from datetime import datetime
 from fpdf import FPDF
 import tempfile
 import re
-import json
+import orjson
 import base64
+import uuid
+import random
+import hashlib
+import threading
+import atexit
+from dataclasses import dataclass
 from PIL import Image
 import io
+import logging
+from collections import Counter
+from itertools import islice
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 作为程序直接运行时，在导入期的缓存、字体检测和角色数据加载之前配置日志，保证这些启动信息不丢失
+# 默认输出 INFO 及以上日志，可通过 PDG_LOG_LEVEL 环境变量调整（如 DEBUG、WARNING）
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv("PDG_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(message)s")
 
 # API 配置
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+# DeepSeek 调用失败时错误提示的前缀（流式输出中途失败时附加在已生成内容之后）
+DEEPSEEK_ERROR_PREFIX = "调用 DeepSeek API 出错"
+
+
+@dataclass(frozen=True)
+class CompletionConfig:
+    """DeepSeek 调用参数：单次请求超时、最大重试次数、最大输出token数"""
+    request_timeout: float = 60
+    max_retries: int = 3
+    max_output_tokens: int = 4000
+
+
+DEFAULT_COMPLETION_CONFIG = CompletionConfig()
+
+# 可重试的HTTP状态码（限流与服务端临时错误）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
 # 千帆ERNIE IRAG API配置
 QIANFAN_API_KEY = os.getenv("QIANFAN_API_KEY")
 QIANFAN_IMAGE_URL = "https://qianfan.baidubce.com/v2/images/generations"
+QIANFAN_IMAGE_MODEL = "irag-1.0"
+QIANFAN_IMAGE_SIZE = "1024x1024"  # 适合头像的尺寸
+
+# 头像生成缓存目录（缓存图片以独立文件保存，索引中只记录键和文件路径）
+IMAGE_CACHE_DIR = "image_cache"
+
+# 全局复用的异步HTTP客户端（HTTP/2长连接，避免每次请求重新进行TCP/TLS握手）
+http_client = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(60, connect=10))
+
+# 千帆图片生成的最大并发数，避免触发接口限流
+IMAGE_CONCURRENCY = 4
+image_semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+
+# 剧本生成与续写共用的并发上限（两个事件通过同一 concurrency_id 共享，流式输出会长时间占用连接）
+GENERATION_CONCURRENCY = 4
+
+# 角色头像存储目录（角色档案中只保存图片路径）
+AVATAR_DIR = "avatars"
+# 头像统一转码为WebP保存的压缩质量
+AVATAR_WEBP_QUALITY = 82
+
+# 角色档案字段
+CHARACTER_FIELDS = ['name', 'role_type', 'age', 'appearance', 'personality', 'background_story', 'habits',
+                    'relationships']
+
+# 角色信息编辑器的空白模板
+EMPTY_CHARACTER_JSON = orjson.dumps(dict.fromkeys(CHARACTER_FIELDS, ""), option=orjson.OPT_INDENT_2).decode()
 
 # 角色档案模板
 ROLE_TEMPLATE = """
@@ -45,97 +108,294 @@ PROMPT_TEMPLATE = """
 """
 
 
+class DebouncedJsonWriter:
+    """延迟写入JSON文件：短时间内的多次保存请求合并为一次原子写入"""
+
+    def __init__(self, path, get_data, delay=0.5):
+        self.path = path
+        self.get_data = get_data
+        self.delay = delay
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def schedule(self):
+        """标记数据已修改，并重新开始延迟计时"""
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """立即写入待保存的数据（先写临时文件再替换，避免写入中断损坏原文件）"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(orjson.dumps(self.get_data(), option=orjson.OPT_INDENT_2))
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except Exception as e:
+                logger.error("❌ 写入 %s 失败: %s", self.path, e)
+
+
+class PromptCache:
+    """API响应缓存：以规范化prompt和生成参数的哈希为键，命中时跳过网络请求"""
+
+    def __init__(self, path, max_entries=500, on_evict=None):
+        self.path = path
+        self.max_entries = max_entries
+        # 条目被淘汰时的回调（参数为被淘汰的值）
+        self.on_evict = on_evict
+        self.entries = {}
+        self.load()
+        # 写入快照，避免序列化时与新写入的条目冲突
+        self.writer = DebouncedJsonWriter(path, lambda: dict(self.entries))
+
+    def load(self):
+        """加载缓存文件"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    self.entries = orjson.loads(f.read())
+                logger.info("✅ 成功加载缓存 %s，条目数: %d", self.path, len(self.entries))
+        except Exception as e:
+            logger.error("❌ 加载缓存失败: %s", e)
+
+    @staticmethod
+    def make_key(prompt, *params):
+        """生成缓存键，prompt中的空白差异不影响命中"""
+        normalized = " ".join(prompt.split())
+        raw = orjson.dumps([normalized, *params])
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries[key] = value
+        # 超出容量时淘汰最早写入的条目
+        while len(self.entries) > self.max_entries:
+            evicted = self.entries.pop(next(iter(self.entries)))
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+        self.writer.schedule()
+
+
+def remove_cached_image(path):
+    """删除被淘汰的缓存图片文件"""
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning("⚠️ 删除缓存图片失败: %s", e)
+
+
+# 千帆图片的响应缓存
+image_cache = PromptCache(os.path.join(IMAGE_CACHE_DIR, "index.json"), max_entries=100, on_evict=remove_cached_image)
+
+
 class CharacterManager:
     def __init__(self):
         self.characters = []
+        # (姓名, 角色类型) 计数索引，用于快速判断角色是否存在
+        self.name_index = Counter()
+        # 下拉菜单选项缓存，角色变更时失效
+        self.dropdown_choices = None
+        self.writer = DebouncedJsonWriter("characters.json", lambda: list(self.characters))
         self.load_characters()
+        self.rebuild_index()
 
     def load_characters(self):
         """加载角色档案"""
         try:
             if os.path.exists("characters.json"):
-                with open("characters.json", "r", encoding="utf-8") as f:
-                    self.characters = json.load(f)
-                    # 为旧数据添加图片字段
-                    for char in self.characters:
-                        if 'avatar_image' not in char:
-                            char['avatar_image'] = None
-                print(f"✅ 成功加载角色档案，数量: {len(self.characters)}")
-                print(f"📋 角色列表: {[char['name'] for char in self.characters]}")
+                with open("characters.json", "rb") as f:
+                    self.characters = orjson.loads(f.read())
+                # 旧数据中的base64头像迁移为独立图片文件，旧格式图片文件转码为WebP
+                migrated = False
+                for char in self.characters:
+                    if 'avatar_path' not in char:
+                        avatar_image = char.pop('avatar_image', None)
+                        char['avatar_path'] = (self.write_avatar(base64.b64decode(avatar_image), ".png")
+                                               if avatar_image else None)
+                        migrated = True
+                    avatar_path = char['avatar_path']
+                    if avatar_path and not avatar_path.endswith(".webp") and os.path.exists(avatar_path):
+                        char['avatar_path'] = self.migrate_avatar(avatar_path)
+                        migrated = migrated or char['avatar_path'] != avatar_path
+                if migrated:
+                    logger.info("🔄 已将角色头像迁移为独立的WebP图片文件")
+                    self.save_characters()
+                logger.info("✅ 成功加载角色档案，数量: %d", len(self.characters))
+                logger.debug("📋 角色列表: %s", [char['name'] for char in self.characters])
             else:
-                print("📁 角色档案文件不存在，创建新的空档案")
+                logger.info("📁 角色档案文件不存在，创建新的空档案")
         except Exception as e:
-            print(f"❌ 加载角色档案失败: {str(e)}")
+            logger.error("❌ 加载角色档案失败: %s", e)
 
     def save_characters(self):
-        """保存角色档案"""
+        """保存角色档案（500ms内的多次修改合并为一次写入，退出时自动落盘）"""
+        self.writer.schedule()
+
+    @staticmethod
+    def index_key(name, role_type):
+        """生成角色索引键（忽略首尾空格和大小写）"""
+        return name.strip().lower(), role_type.strip().lower()
+
+    def rebuild_index(self):
+        """重建角色索引"""
+        self.name_index = Counter(self.index_key(char['name'], char['role_type']) for char in self.characters)
+        self.dropdown_choices = None
+
+    def index_character(self, char):
+        """将角色加入索引"""
+        self.name_index[self.index_key(char['name'], char['role_type'])] += 1
+        self.dropdown_choices = None
+
+    def unindex_character(self, char):
+        """将角色移出索引"""
+        key = self.index_key(char['name'], char['role_type'])
+        self.name_index[key] -= 1
+        if self.name_index[key] <= 0:
+            del self.name_index[key]
+        self.dropdown_choices = None
+
+    @staticmethod
+    def encode_avatar(image_bytes):
+        """将头像图片转码为WebP（体积约为PNG的三分之一）"""
+        buffer = io.BytesIO()
+        Image.open(io.BytesIO(image_bytes)).convert("RGB").save(buffer, "WEBP", quality=AVATAR_WEBP_QUALITY,
+                                                                method=6)
+        return buffer.getvalue()
+
+    @staticmethod
+    def write_avatar(image_bytes, ext=".webp"):
+        """将头像图片写入独立文件，返回文件路径"""
+        os.makedirs(AVATAR_DIR, exist_ok=True)
+        path = os.path.join(AVATAR_DIR, f"{uuid.uuid4().hex}{ext}")
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+        return path
+
+    def migrate_avatar(self, path):
+        """将旧格式头像文件转码为WebP，返回新路径（无法转码时保留原文件）"""
         try:
-            with open("characters.json", "w", encoding="utf-8") as f:
-                json.dump(self.characters, f, ensure_ascii=False, indent=2)
-            print(f"💾 角色档案已保存，数量: {len(self.characters)}")
-            print(f"📋 保存的角色: {[char['name'] for char in self.characters]}")
+            with open(path, "rb") as f:
+                new_path = self.write_avatar(self.encode_avatar(f.read()))
         except Exception as e:
-            print(f"❌ 保存角色档案失败: {str(e)}")
+            logger.warning("⚠️ 头像转码WebP失败，保留原文件 %s: %s", path, e)
+            return path
+        self.remove_avatar(path)
+        return new_path
+
+    @staticmethod
+    def remove_avatar(path):
+        """删除不再使用的头像文件"""
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("⚠️ 删除头像文件失败: %s", e)
 
     def add_character(self, character_data):
         """添加角色"""
-        character_data['avatar_image'] = None
+        character_data['avatar_path'] = None
         self.characters.append(character_data)
+        self.index_character(character_data)
         self.save_characters()
-        print(f"➕ 角色已添加: {character_data['name']}, 当前角色数量: {len(self.characters)}")
+        logger.info("➕ 角色已添加: %s, 当前角色数量: %d", character_data['name'], len(self.characters))
 
     def update_character(self, index, character_data):
-        """更新角色"""
+        """更新角色（原地修改角色字典，进行中的头像生成仍能找到该角色）"""
         if 0 <= index < len(self.characters):
+            char = self.characters[index]
+            old_name = char['name']
+            self.unindex_character(char)
             # 保留原有图片
-            if 'avatar_image' in self.characters[index]:
-                character_data['avatar_image'] = self.characters[index]['avatar_image']
-            else:
-                character_data['avatar_image'] = None
-            old_name = self.characters[index]['name']
-            self.characters[index] = character_data
-            self.save_characters()
-            print(f"✏️ 角色已更新: {old_name} -> {character_data['name']}")
-
-    def update_character_image(self, index, image_data):
-        """更新角色图片"""
-        if 0 <= index < len(self.characters):
-            self.characters[index]['avatar_image'] = image_data
+            character_data['avatar_path'] = char.get('avatar_path')
+            char.clear()
+            char.update(character_data)
+            self.index_character(char)
             self.save_characters()
-            print(f"🎨 角色头像已更新: {self.characters[index]['name']}")
+            logger.info("✏️ 角色已更新: %s -> %s", old_name, char['name'])
+
+    def find_character(self, character):
+        """按对象身份查找角色当前的索引，角色已被删除时返回 None"""
+        return next((i for i, char in enumerate(self.characters) if char is character), None)
+
+    def update_character_image(self, character, image_bytes):
+        """更新角色图片（image_bytes 为已转码的WebP数据），返回新图片路径；角色已被删除时返回 None"""
+        if self.find_character(character) is None:
+            return None
+        old_path = character.get('avatar_path')
+        character['avatar_path'] = self.write_avatar(image_bytes)
+        self.remove_avatar(old_path)
+        self.save_characters()
+        logger.info("🎨 角色头像已更新: %s", character['name'])
+        return character['avatar_path']
 
     def delete_character(self, index):
         """删除角色"""
         if 0 <= index < len(self.characters):
             deleted_name = self.characters[index]['name']
+            self.remove_avatar(self.characters[index].get('avatar_path'))
+            self.unindex_character(self.characters[index])
             del self.characters[index]
             self.save_characters()
-            print(f"🗑️ 角色已删除: {deleted_name}, 剩余角色数量: {len(self.characters)}")
+            logger.info("🗑️ 角色已删除: %s, 剩余角色数量: %d", deleted_name, len(self.characters))
 
     def get_dropdown_choices(self):
-        """获取下拉菜单选项"""
-        choices = [f"{i}: {char['name']} ({char['role_type']})" for i, char in enumerate(self.characters)]
-        print(f"🔄 生成角色选项: {choices}")
-        return choices
+        """获取下拉菜单选项（角色未变更时直接复用缓存），选项值为角色索引"""
+        if self.dropdown_choices is None:
+            self.dropdown_choices = [(f"{i}: {char['name']} ({char['role_type']})", i)
+                                     for i, char in enumerate(self.characters)]
+            logger.debug("🔄 生成角色选项: %s", self.dropdown_choices)
+        return self.dropdown_choices
 
     def format_roles_for_prompt(self, selected_indices):
-        """格式化角色信息用于prompt"""
-        formatted_roles = []
-        for idx in selected_indices:
-            try:
-                char_index = int(idx.split(":")[0])
-                if 0 <= char_index < len(self.characters):
-                    char = self.characters[char_index]
-                    formatted_roles.append(ROLE_TEMPLATE.format(**char))
-            except (ValueError, IndexError):
-                continue
-        return "\n".join(formatted_roles)
+        """格式化角色信息用于prompt（selected_indices 为下拉菜单返回的角色索引）"""
+        return "\n".join(format_character(self.characters[idx])
+                         for idx in selected_indices or [] if 0 <= idx < len(self.characters))
 
     def character_exists(self, name, role_type):
         """检查角色是否存在"""
-        return any(char['name'].strip().lower() == name.strip().lower() and
-                   char['role_type'].strip().lower() == role_type.strip().lower()
-                   for char in self.characters)
+        return self.index_key(name, role_type) in self.name_index
+
+
+def character_to_json(char):
+    """将角色档案转换为编辑器中的JSON文本"""
+    return orjson.dumps({key: char.get(key, "") for key in CHARACTER_FIELDS}, option=orjson.OPT_INDENT_2).decode()
+
+
+def parse_character_json(text):
+    """解析编辑器中的角色JSON，返回 (角色数据, 错误信息)"""
+    try:
+        data = orjson.loads(text or "{}")
+    except orjson.JSONDecodeError as e:
+        return None, f"角色信息不是有效的JSON: {e}"
+    if not isinstance(data, dict):
+        return None, "角色信息必须是JSON对象"
+    return {key: str(data.get(key) or "").strip() for key in CHARACTER_FIELDS}, None
+
+
+@lru_cache(maxsize=128)
+def format_role(values):
+    """按角色档案模板格式化角色信息（values 为按 CHARACTER_FIELDS 顺序排列的字段值）"""
+    return ROLE_TEMPLATE.format(**dict(zip(CHARACTER_FIELDS, values)))
+
+
+def format_character(char):
+    """格式化角色档案（以字段内容为缓存键，角色修改后自然生成新的缓存项）"""
+    return format_role(tuple(char.get(key, "") for key in CHARACTER_FIELDS))
 
 
 # 图片生成相关函数
@@ -175,8 +435,8 @@ def generate_character_prompt(character_data):
     return prompt
 
 
-def call_qianfan_image_api(prompt):
-    """调用千帆ERNIE IRAG API生成图片"""
+async def call_qianfan_image_api(prompt):
+    """调用千帆ERNIE IRAG API生成图片，返回原始图片字节"""
     if not QIANFAN_API_KEY:
         return None, "未配置千帆API密钥，请在环境变量中设置 QIANFAN_API_KEY"
 
@@ -186,97 +446,173 @@ def call_qianfan_image_api(prompt):
     }
 
     data = {
-        "model": "irag-1.0",
+        "model": QIANFAN_IMAGE_MODEL,
         "prompt": prompt,
         "n": 1,
-        "size": "1024x1024",  # 适合头像的尺寸
+        "size": QIANFAN_IMAGE_SIZE,
     }
 
     try:
-        response = requests.post(QIANFAN_IMAGE_URL, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        async with image_semaphore:
+            response = await http_client.post(QIANFAN_IMAGE_URL, headers=headers, json=data)
+            response.raise_for_status()
+            result = orjson.loads(response.content)
 
-        if result.get("data") and len(result["data"]) > 0:
-            image_url = result["data"][0]["url"]
+            if result.get("data") and len(result["data"]) > 0:
+                image_url = result["data"][0]["url"]
 
-            # 下载图片并转换为base64
-            img_response = requests.get(image_url, timeout=30)
-            img_response.raise_for_status()
-            image_base64 = base64.b64encode(img_response.content).decode()
+                # 复用同一客户端下载图片，直接返回原始字节
+                img_response = await http_client.get(image_url, timeout=30)
+                img_response.raise_for_status()
 
-            return image_base64, "图片生成成功！"
-        else:
-            return None, "API返回数据异常，请检查prompt内容"
+                return img_response.content, "图片生成成功！"
+            else:
+                return None, "API返回数据异常，请检查prompt内容"
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return None, f"网络请求失败：{str(e)}"
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         return None, f"API响应格式错误：{str(e)}"
     except Exception as e:
         return None, f"调用千帆API出错：{str(e)}"
 
 
-def generate_character_image(character_index):
-    """生成角色图片的主函数"""
-    if character_index == -1:
-        return None, "请先选择角色"
+def cache_image(key, image_bytes):
+    """将转码后的头像写入缓存目录，索引中只记录文件路径"""
+    try:
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        path = os.path.join(IMAGE_CACHE_DIR, f"{key}.webp")
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+        image_cache.set(key, path)
+    except OSError as e:
+        logger.warning("⚠️ 写入图片缓存失败: %s", e)
 
-    if character_index >= len(character_manager.characters):
-        return None, "角色索引无效"
 
-    character_data = character_manager.characters[character_index]
+async def generate_character_image(character_data, regenerate=False):
+    """为指定角色生成图片（regenerate 为 True 时忽略缓存，重新调用千帆API）"""
     prompt = generate_character_prompt(character_data)
 
-    print(f"🎨 生成图片的prompt: {prompt}")  # 调试信息
+    logger.debug("🎨 生成图片的prompt: %s", prompt)
 
-    image_data, message = call_qianfan_image_api(prompt)
+    # 缓存中保存的是转码后的WebP，命中时无需再次转码
+    cache_key = PromptCache.make_key(prompt, QIANFAN_IMAGE_MODEL, QIANFAN_IMAGE_SIZE)
+    cached_path = None if regenerate else image_cache.get(cache_key)
+    if cached_path and os.path.exists(cached_path):
+        logger.info("♻️ 命中图片缓存，跳过千帆API调用")
+        with open(cached_path, "rb") as f:
+            webp_bytes = f.read()
+        message = "图片生成成功（缓存）！"
+    else:
+        image_bytes, message = await call_qianfan_image_api(prompt)
+        if not image_bytes:
+            return None, message
 
-    if image_data:
-        # 保存图片到角色档案
-        character_manager.update_character_image(character_index, image_data)
-        # 转换为PIL Image对象供Gradio显示
+        # 转码为WebP（CPU密集，放到线程中执行，避免阻塞事件循环）
         try:
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            return image, message
+            webp_bytes = await asyncio.to_thread(CharacterManager.encode_avatar, image_bytes)
         except Exception as e:
             return None, f"图片处理失败：{str(e)}"
+        cache_image(cache_key, webp_bytes)
+
+    # 生成期间角色列表可能被修改，保存时按对象身份重新查找角色；直接返回图片路径供Gradio显示
+    avatar_path = character_manager.update_character_image(character_data, webp_bytes)
+    if avatar_path is None:
+        return None, f"角色 '{character_data['name']}' 已被删除，头像保存失败"
+    return avatar_path, message
+
+
+async def generate_all_character_images(progress=None):
+    """并发为所有角色生成头像（并发数受 IMAGE_CONCURRENCY 限制），返回成功数量和总数"""
+    # 记录开始时的角色对象快照，批量生成期间角色被增删也不会错位
+    characters = list(character_manager.characters)
+    total = len(characters)
+    completed = 0
+
+    async def generate_one(character):
+        nonlocal completed
+        try:
+            image, message = await generate_character_image(character)
+        except Exception as e:
+            image, message = None, f"生成出错：{e}"
+        completed += 1
+        logger.info("🎨 批量生成进度 %d/%d: %s", completed, total, message)
+        if progress is not None:
+            progress(completed / total, desc=f"已完成 {completed}/{total}")
+        return image is not None
 
-    return None, message
+    results = await asyncio.gather(*(generate_one(char) for char in characters), return_exceptions=True)
+    return sum(result is True for result in results), total
 
 
 def get_character_image(character_index):
-    """获取角色的已有图片"""
+    """获取角色的已有图片路径"""
     if character_index == -1 or character_index >= len(character_manager.characters):
         return None
 
     character = character_manager.characters[character_index]
-    if character.get('avatar_image'):
-        try:
-            image_bytes = base64.b64decode(character['avatar_image'])
-            image = Image.open(io.BytesIO(image_bytes))
-            return image
-        except Exception as e:
-            print(f"加载角色图片失败: {str(e)}")
+    avatar_path = character.get('avatar_path')
+    # 直接返回图片文件路径，由Gradio按原文件提供给浏览器，无需解码再重新编码
+    if avatar_path and os.path.exists(avatar_path):
+        return avatar_path
 
     return None
 
 
 # 剧本生成相关函数
+CJK_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fa5]')
+
+
 def count_words(text):
     """统计中文字符数（排除标点符号）"""
     if not text:
         return 0
-    chinese_chars = re.findall(r'[\u4e00-\u9fa5]', text)
-    return len(chinese_chars)
+    return len(CJK_CHAR_PATTERN.findall(text))
 
 
-def call_deepseek_api(prompt, temperature=0.9):
-    """调用DeepSeek API"""
-    if not DEEPSEEK_API_KEY:
-        return "错误：未配置 DeepSeek API 密钥。"
+# 生成结果标题格式；流式输出时字数每跨过 LABEL_UPDATE_STEP 字才更新一次标题
+OUTPUT_LABEL_FMT = "📖 生成结果 ({} 字中文)".format
+LABEL_UPDATE_STEP = 50
+
+
+def get_retry_delay(attempt, response=None):
+    """计算重试等待时间：429优先遵循Retry-After，否则指数退避并加随机抖动"""
+    if response is not None and response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return 2 ** attempt + random.random()
+
 
+async def send_with_retry(url, headers, data, config, stream=False):
+    """带超时与有限重试的POST请求，超时、网络错误、429及5xx会重试"""
+    # stream=True 时返回未读取正文的流式响应：超时只限制到收到响应头为止，由调用方负责关闭响应
+    for attempt in range(config.max_retries + 1):
+        try:
+            request = http_client.build_request("POST", url, headers=headers, json=data)
+            response = await asyncio.wait_for(
+                http_client.send(request, stream=stream),
+                timeout=config.request_timeout
+            )
+            if response.is_error:
+                await response.aclose()
+            response.raise_for_status()
+            return response
+        except (asyncio.TimeoutError, httpx.TransportError):
+            if attempt == config.max_retries:
+                raise
+            delay = get_retry_delay(attempt)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in RETRYABLE_STATUS_CODES or attempt == config.max_retries:
+                raise
+            delay = get_retry_delay(attempt, e.response)
+
+        logger.warning("⏳ 请求失败，%.1f秒后进行第%d次重试（共%d次）", delay, attempt + 1, config.max_retries)
+        await asyncio.sleep(delay)
+
+
+def build_deepseek_request(prompt, temperature, config):
+    """构建DeepSeek请求头和请求体"""
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
@@ -289,19 +625,63 @@ def call_deepseek_api(prompt, temperature=0.9):
             {"role": "user", "content": prompt}
         ],
         "temperature": float(temperature),
-        "max_tokens": 4000
+        "max_tokens": config.max_output_tokens
     }
+    return headers, data
+
+
+async def call_deepseek_api(prompt, temperature=0.9, config=DEFAULT_COMPLETION_CONFIG):
+    """调用DeepSeek API"""
+    if not DEEPSEEK_API_KEY:
+        return "错误：未配置 DeepSeek API 密钥。"
+
+    headers, data = build_deepseek_request(prompt, temperature, config)
 
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        response = await send_with_retry(DEEPSEEK_API_URL, headers, data, config)
+        result = orjson.loads(response.content)
         return result["choices"][0]["message"]["content"]
+    except asyncio.TimeoutError:
+        return f"{DEEPSEEK_ERROR_PREFIX}：请求超时（{config.request_timeout}秒）"
     except Exception as e:
-        return f"调用 DeepSeek API 出错：{str(e)}"
+        return f"{DEEPSEEK_ERROR_PREFIX}：{str(e)}"
 
 
-def adjust_script_length(script, word_limit):
+async def stream_deepseek_api(prompt, temperature=0.9, config=DEFAULT_COMPLETION_CONFIG):
+    """流式调用DeepSeek API，每收到新内容就产出一次当前累计的完整文本"""
+    if not DEEPSEEK_API_KEY:
+        yield "错误：未配置 DeepSeek API 密钥。"
+        return
+
+    headers, data = build_deepseek_request(prompt, temperature, config)
+    data["stream"] = True
+    content = ""
+    try:
+        response = await send_with_retry(DEEPSEEK_API_URL, headers, data, config, stream=True)
+        try:
+            # 解析SSE数据帧：data: {...}，以 data: [DONE] 结束
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                delta = orjson.loads(payload)["choices"][0]["delta"].get("content")
+                if delta:
+                    content += delta
+                    yield content
+        finally:
+            await response.aclose()
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            error = f"{DEEPSEEK_ERROR_PREFIX}：请求超时（{config.request_timeout}秒）"
+        else:
+            error = f"{DEEPSEEK_ERROR_PREFIX}：{str(e)}"
+        # 中途失败时保留已生成的内容，错误提示附加在末尾
+        yield f"{content}\n\n⚠️ {error}" if content else error
+
+
+async def adjust_script_length(script, word_limit):
     """调整剧本长度"""
     if not word_limit:
         return script
@@ -311,29 +691,21 @@ def adjust_script_length(script, word_limit):
 
     if current_words < target_min:
         prompt = f"请将以下剧本扩充到{target_min}-{target_max}字(仅统计中文字符)，保持内容连贯:\n{script}"
-        expanded_script = call_deepseek_api(prompt, 0.7)
+        expanded_script = await call_deepseek_api(prompt, 0.7)
         return expanded_script if "出错" not in expanded_script else script
 
     elif current_words > target_max:
-        sentences = re.split(r'(?<=[。！？])', script)
-        new_script = ""
-        char_count = 0
-
-        for sentence in sentences:
-            sentence_words = count_words(sentence)
-            if char_count + sentence_words > target_max:
-                break
-            new_script += sentence
-            char_count += sentence_words
-
-        return new_script.strip()
+        # 定位第 target_max+1 个中文字符，在它之前最后一个句末标点处截断，只保留完整句子
+        overflow_pos = next(islice(CJK_CHAR_PATTERN.finditer(script), target_max, None)).start()
+        cut_pos = max(script.rfind(mark, 0, overflow_pos) for mark in "。！？") + 1
+        return script[:cut_pos].strip()
 
     return script
 
 
-def generate_script(title, selected_chars, manual_roles, style, background, prompt, tone, temperature, word_limit,
-                    append=False):
-    """生成剧本主函数"""
+async def generate_script(title, selected_chars, manual_roles, style, background, prompt, tone, temperature, word_limit,
+                          append=False):
+    """生成剧本主函数，流式产出当前已生成的剧本内容"""
     length_instruction = (
         f"请将剧本片段控制在 **{word_limit} 到 {int(word_limit) + 100} 字之间**（仅统计中文字符）。"
         f"内容不要超出限制，避免重复或冗长描述。"
@@ -356,8 +728,93 @@ def generate_script(title, selected_chars, manual_roles, style, background, prom
         if tone:
             full_prompt += f"\n风格语气要求：{tone}"
 
-    script = call_deepseek_api(full_prompt, temperature)
-    return adjust_script_length(script, word_limit) if word_limit else script
+    script = ""
+    async for script in stream_deepseek_api(full_prompt, temperature):
+        yield script
+
+    # 生成失败时不调整长度，避免截断或改写掉错误提示
+    if word_limit and DEEPSEEK_ERROR_PREFIX not in script:
+        adjusted_script = await adjust_script_length(script, word_limit)
+        if adjusted_script != script:
+            yield adjusted_script
+
+
+# PDF导出：中文标点到ASCII标点的映射
+PDF_PUNCTUATION_MAP = {
+    '：': ': ', '，': ', ', '。': '. ', '？': '? ', '！': '! ',
+    '（': '(', '）': ')', '【': '[', '】': ']', '『': '[', '』': ']',
+    '“': '"', '”': '"', '‘': "'", '’': "'",
+    '—': '-', '–': '-', '…': '...', '、': ', ',
+    '；': '; ', '｜': '|', '〈': '<', '〉': '>',
+    '《': '<', '》': '>', '「': '[', '」': ']'
+}
+
+# PDF导出：常用中文词汇到拼音的映射
+PDF_PINYIN_MAP = {
+    # 基础词汇
+    '的': 'de', '了': 'le', '在': 'zai', '是': 'shi', '我': 'wo', '有': 'you', '和': 'he', '就': 'jiu',
+    '不': 'bu', '人': 'ren', '都': 'dou', '一': 'yi', '个': 'ge', '上': 'shang', '也': 'ye', '很': 'hen',
+    '到': 'dao', '说': 'shuo', '要': 'yao', '去': 'qu', '你': 'ni', '会': 'hui', '着': 'zhe', '没': 'mei',
+    '看': 'kan', '好': 'hao', '自': 'zi', '己': 'ji', '面': 'mian', '前': 'qian', '最': 'zui', '新': 'xin',
+
+    # 人称代词
+    '他': 'ta', '她': 'ta', '它': 'ta', '们': 'men', '这': 'zhe', '那': 'na', '什': 'shen', '么': 'me',
+    '哪': 'na', '里': 'li', '怎': 'zen', '样': 'yang', '多': 'duo', '少': 'shao', '几': 'ji',
+
+    # 动词
+    '来': 'lai', '走': 'zou', '跑': 'pao', '飞': 'fei', '游': 'you', '坐': 'zuo', '站': 'zhan', '躺': 'tang',
+    '吃': 'chi', '喝': 'he', '睡': 'shui', '醒': 'xing', '想': 'xiang', '知': 'zhi', '道': 'dao', '听': 'ting',
+    '做': 'zuo', '给': 'gei', '拿': 'na', '放': 'fang', '开': 'kai', '关': 'guan', '买': 'mai', '卖': 'mai',
+    '找': 'zhao', '等': 'deng', '帮': 'bang', '打': 'da', '写': 'xie', '读': 'du', '学': 'xue', '教': 'jiao',
+
+    # 形容词
+    '大': 'da', '小': 'xiao', '高': 'gao', '低': 'di', '长': 'chang', '短': 'duan', '宽': 'kuan', '窄': 'zhai',
+    '快': 'kuai', '慢': 'man', '旧': 'jiu', '轻': 'qing',
+    '美': 'mei', '丑': 'chou', '胖': 'pang', '瘦': 'shou', '强': 'qiang', '弱': 'ruo', '聪': 'cong',
+    '明': 'ming',
+
+    # 方位词
+    '东': 'dong', '南': 'nan', '西': 'xi', '北': 'bei', '中': 'zhong', '内': 'nei', '外': 'wai',
+    '左': 'zuo', '右': 'you', '后': 'hou', '旁': 'pang', '边': 'bian', '间': 'jian', '处': 'chu',
+
+    # 时间词
+    '年': 'nian', '月': 'yue', '日': 'ri', '天': 'tian', '时': 'shi', '分': 'fen', '秒': 'miao',
+    '今': 'jin', '昨': 'zuo', '现': 'xian', '过': 'guo', '将': 'jiang', '未': 'wei',
+    '春': 'chun', '夏': 'xia', '秋': 'qiu', '冬': 'dong', '早': 'zao', '午': 'wu', '晚': 'wan', '夜': 'ye',
+
+    # 地点词
+    '家': 'jia', '校': 'xiao', '园': 'yuan', '公': 'gong', '司': 'si', '店': 'dian', '场': 'chang',
+    '路': 'lu', '街': 'jie', '桥': 'qiao', '山': 'shan', '水': 'shui', '河': 'he', '海': 'hai',
+    '城': 'cheng', '市': 'shi', '镇': 'zhen', '村': 'cun', '国': 'guo', '省': 'sheng', '县': 'xian',
+
+    # 剧本相关词汇
+    '剧': 'ju', '本': 'ben', '角': 'jue', '色': 'se', '演': 'yan', '员': 'yuan', '导': 'dao',
+    '编': 'bian', '制': 'zhi', '片': 'pian', '电': 'dian', '影': 'ying', '视': 'shi', '频': 'pin',
+    '舞': 'wu', '台': 'tai', '话': 'hua', '音': 'yin', '歌': 'ge',
+
+    # 情感词
+    '爱': 'ai', '恨': 'hen', '喜': 'xi', '欢': 'huan', '怒': 'nu', '哀': 'ai', '乐': 'le',
+    '兴': 'xing', '伤': 'shang', '心': 'xin', '害': 'hai', '怕': 'pa', '担': 'dan',
+    '紧': 'jin', '张': 'zhang', '松': 'song', '平': 'ping', '静': 'jing', '激': 'ji',
+    '动': 'dong',
+
+    # 常用组合词
+    '什么': 'shenme', '怎么': 'zenme', '为什么': 'weishenme', '那么': 'name', '这么': 'zheme',
+    '不过': 'buguo', '但是': 'danshi', '然而': 'ranér', '因为': 'yinwei', '所以': 'suoyi',
+    '如果': 'ruguo', '要是': 'yaoshi', '虽然': 'suiran', '虽说': 'suishuo', '尽管': 'jinguan',
+    '可能': 'keneng', '也许': 'yexu', '大概': 'dagai', '应该': 'yinggai', '必须': 'bixu',
+    '已经': 'yijing', '正在': 'zhengzai', '刚才': 'gangcai', '现在': 'xianzai', '以后': 'yihou',
+    '学校': 'xuexiao', '老师': 'laoshi', '学生': 'xuesheng', '同学': 'tongxue', '朋友': 'pengyou',
+    '家人': 'jiaren', '父亲': 'fuqin', '母亲': 'muqin', '儿子': 'erzi', '女儿': 'nüer',
+    '哥哥': 'gege', '姐姐': 'jiejie', '弟弟': 'didi', '妹妹': 'meimei', '爷爷': 'yeye', '奶奶': 'nainai',
+}
+
+# 预编译的PDF文本清理规则，导出时只需单次扫描
+PDF_PUNCTUATION_TABLE = str.maketrans(PDF_PUNCTUATION_MAP)
+PDF_PINYIN_PATTERN = re.compile('|'.join(map(re.escape, sorted(PDF_PINYIN_MAP, key=len, reverse=True))))
+CJK_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+NON_LATIN1_PATTERN = re.compile(r'[^\x00-\xff\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
 
 
 def clean_text_for_pdf(text):
@@ -366,112 +823,28 @@ def clean_text_for_pdf(text):
         return ""
 
     try:
-        print("🧹 开始改进的文本清理...")
-
-        # 1. 首先替换标点符号
-        punctuation_map = {
-            '：': ': ', '，': ', ', '。': '. ', '？': '? ', '！': '! ',
-            '（': '(', '）': ')', '【': '[', '】': ']', '『': '[', '』': ']',
-            '"': '"', '"': '"', ''': "'", ''': "'",
-            '—': '-', '–': '-', '…': '...', '、': ', ',
-            '；': '; ', '｜': '|', '〈': '<', '〉': '>',
-            '《': '<', '》': '>', '「': '[', '」': ']'
-        }
-
-        cleaned_text = text
-        for chinese_punct, english_punct in punctuation_map.items():
-            cleaned_text = cleaned_text.replace(chinese_punct, english_punct)
-
-        # 2. 扩展的中文词汇映射表
-        chinese_words = {
-            # 基础词汇
-            '的': 'de', '了': 'le', '在': 'zai', '是': 'shi', '我': 'wo', '有': 'you', '和': 'he', '就': 'jiu',
-            '不': 'bu', '人': 'ren', '都': 'dou', '一': 'yi', '个': 'ge', '上': 'shang', '也': 'ye', '很': 'hen',
-            '到': 'dao', '说': 'shuo', '要': 'yao', '去': 'qu', '你': 'ni', '会': 'hui', '着': 'zhe', '没': 'mei',
-            '看': 'kan', '好': 'hao', '自': 'zi', '己': 'ji', '面': 'mian', '前': 'qian', '最': 'zui', '新': 'xin',
-
-            # 人称代词
-            '他': 'ta', '她': 'ta', '它': 'ta', '们': 'men', '这': 'zhe', '那': 'na', '什': 'shen', '么': 'me',
-            '哪': 'na', '里': 'li', '怎': 'zen', '样': 'yang', '多': 'duo', '少': 'shao', '几': 'ji',
-
-            # 动词
-            '来': 'lai', '走': 'zou', '跑': 'pao', '飞': 'fei', '游': 'you', '坐': 'zuo', '站': 'zhan', '躺': 'tang',
-            '吃': 'chi', '喝': 'he', '睡': 'shui', '醒': 'xing', '想': 'xiang', '知': 'zhi', '道': 'dao', '听': 'ting',
-            '做': 'zuo', '给': 'gei', '拿': 'na', '放': 'fang', '开': 'kai', '关': 'guan', '买': 'mai', '卖': 'mai',
-            '找': 'zhao', '等': 'deng', '帮': 'bang', '打': 'da', '写': 'xie', '读': 'du', '学': 'xue', '教': 'jiao',
-
-            # 形容词
-            '大': 'da', '小': 'xiao', '高': 'gao', '低': 'di', '长': 'chang', '短': 'duan', '宽': 'kuan', '窄': 'zhai',
-            '快': 'kuai', '慢': 'man', '早': 'zao', '晚': 'wan', '新': 'xin', '旧': 'jiu', '年': 'nian', '轻': 'qing',
-            '美': 'mei', '丑': 'chou', '胖': 'pang', '瘦': 'shou', '强': 'qiang', '弱': 'ruo', '聪': 'cong',
-            '明': 'ming',
-
-            # 方位词
-            '东': 'dong', '南': 'nan', '西': 'xi', '北': 'bei', '中': 'zhong', '内': 'nei', '外': 'wai',
-            '左': 'zuo', '右': 'you', '后': 'hou', '旁': 'pang', '边': 'bian', '间': 'jian', '处': 'chu',
-
-            # 时间词
-            '年': 'nian', '月': 'yue', '日': 'ri', '天': 'tian', '时': 'shi', '分': 'fen', '秒': 'miao',
-            '今': 'jin', '明': 'ming', '昨': 'zuo', '现': 'xian', '过': 'guo', '将': 'jiang', '未': 'wei',
-            '春': 'chun', '夏': 'xia', '秋': 'qiu', '冬': 'dong', '早': 'zao', '午': 'wu', '晚': 'wan', '夜': 'ye',
-
-            # 地点词
-            '家': 'jia', '校': 'xiao', '园': 'yuan', '公': 'gong', '司': 'si', '店': 'dian', '场': 'chang',
-            '路': 'lu', '街': 'jie', '桥': 'qiao', '山': 'shan', '水': 'shui', '河': 'he', '海': 'hai',
-            '城': 'cheng', '市': 'shi', '镇': 'zhen', '村': 'cun', '国': 'guo', '省': 'sheng', '县': 'xian',
-
-            # 剧本相关词汇
-            '剧': 'ju', '本': 'ben', '角': 'jue', '色': 'se', '演': 'yan', '员': 'yuan', '导': 'dao', '演': 'yan',
-            '编': 'bian', '剧': 'ju', '制': 'zhi', '片': 'pian', '电': 'dian', '影': 'ying', '视': 'shi', '频': 'pin',
-            '舞': 'wu', '台': 'tai', '话': 'hua', '剧': 'ju', '音': 'yin', '乐': 'yue', '歌': 'ge', '舞': 'wu',
-
-            # 情感词
-            '爱': 'ai', '恨': 'hen', '喜': 'xi', '欢': 'huan', '怒': 'nu', '哀': 'ai', '乐': 'le',
-            '高': 'gao', '兴': 'xing', '伤': 'shang', '心': 'xin', '害': 'hai', '怕': 'pa', '担': 'dan', '心': 'xin',
-            '紧': 'jin', '张': 'zhang', '放': 'fang', '松': 'song', '平': 'ping', '静': 'jing', '激': 'ji',
-            '动': 'dong',
-
-            # 常用组合词
-            '什么': 'shenme', '怎么': 'zenme', '为什么': 'weishenme', '那么': 'name', '这么': 'zheme',
-            '不过': 'buguo', '但是': 'danshi', '然而': 'ranér', '因为': 'yinwei', '所以': 'suoyi',
-            '如果': 'ruguo', '要是': 'yaoshi', '虽然': 'suiran', '虽说': 'suishuo', '尽管': 'jinguan',
-            '可能': 'keneng', '也许': 'yexu', '大概': 'dagai', '应该': 'yinggai', '必须': 'bixu',
-            '已经': 'yijing', '正在': 'zhengzai', '刚才': 'gangcai', '现在': 'xianzai', '以后': 'yihou',
-            '学校': 'xuexiao', '老师': 'laoshi', '学生': 'xuesheng', '同学': 'tongxue', '朋友': 'pengyou',
-            '家人': 'jiaren', '父亲': 'fuqin', '母亲': 'muqin', '儿子': 'erzi', '女儿': 'nüer',
-            '哥哥': 'gege', '姐姐': 'jiejie', '弟弟': 'didi', '妹妹': 'meimei', '爷爷': 'yeye', '奶奶': 'nainai',
-        }
-
-        # 3. 按长度排序替换（先替换长词，避免被短词误替换）
-        sorted_words = sorted(chinese_words.items(), key=lambda x: len(x[0]), reverse=True)
-        for chinese, pinyin in sorted_words:
-            cleaned_text = cleaned_text.replace(chinese, pinyin)
-
-        # 4. 处理剩余的中文字符 - 使用更智能的方法
-        final_text = ""
-        for char in cleaned_text:
-            if ord(char) <= 255:  # ASCII和Latin-1范围内的字符
-                final_text += char
-            elif char.isspace():  # 保留所有空白字符
-                final_text += char
-            elif '\u4e00' <= char <= '\u9fff':  # 中文字符范围
-                # 对于未映射的中文字符，使用更友好的替换
-                final_text += "[CN]"  # 标记为中文字符
-            else:
-                final_text += "?"  # 其他特殊字符
+        logger.debug("🧹 开始改进的文本清理...")
+
+        # 1. 单次遍历替换标点符号
+        cleaned_text = text.translate(PDF_PUNCTUATION_TABLE)
+
+        # 2. 单次正则扫描替换中文词汇（备选项按长度降序，优先匹配长词）
+        cleaned_text = PDF_PINYIN_PATTERN.sub(lambda m: PDF_PINYIN_MAP[m.group(0)], cleaned_text)
 
-        # 5. 清理多余的标记和空格
-        final_text = re.sub(r'\[CN\]\[CN\]+', '[CN]', final_text)  # 合并连续的中文标记
-        final_text = re.sub(r'\s+', ' ', final_text)  # 合并多个空格
-        final_text = final_text.strip()
+        # 3. 处理剩余字符：连续的未映射中文字符合并标记为[CN]，其他非Latin-1字符（空白除外）替换为?
+        final_text = CJK_RUN_PATTERN.sub('[CN]', cleaned_text)
+        final_text = NON_LATIN1_PATTERN.sub('?', final_text)
 
-        print(f"✅ 改进文本清理完成: {len(text)} -> {len(final_text)} 字符")
-        print(f"📊 处理结果预览: {final_text[:100]}{'...' if len(final_text) > 100 else ''}")
+        # 4. 合并多个空格
+        final_text = WHITESPACE_PATTERN.sub(' ', final_text).strip()
+
+        logger.debug("✅ 改进文本清理完成: %d -> %d 字符", len(text), len(final_text))
+        logger.debug("📊 处理结果预览: %.100s", final_text)
 
         return final_text
 
     except Exception as e:
-        print(f"❌ 文本清理失败: {e}")
+        logger.error("❌ 文本清理失败: %s", e)
         # 最安全的备用方案 - 只保留ASCII字符
         safe_text = ''.join(c if ord(c) < 128 else '[?]' for c in text)
         return safe_text
@@ -481,9 +854,6 @@ def create_enhanced_text_export(text):
     """创建增强的文本文件导出"""
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"script_export_{timestamp}.txt"
-
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w', encoding='utf-8')
 
         # 创建美观的文本格式
         header = f"""
@@ -507,29 +877,28 @@ def create_enhanced_text_export(text):
 {'=' * 60}
 """
 
-        # 写入文件
-        temp_file.write(header)
-        temp_file.write(text)
-        temp_file.write(footer)
-        temp_file.close()
+        # 拼接后一次性编码写入，使用1MB缓冲区减少系统调用
+        content = (header + text + footer).encode('utf-8')
+        fd, file_path = tempfile.mkstemp(suffix='.txt', prefix=f"script_export_{timestamp}_")
+        with os.fdopen(fd, 'wb', buffering=1 << 20) as f:
+            f.write(content)
 
-        file_size = os.path.getsize(temp_file.name)
-        print(f"✅ 增强文本文件创建成功: {temp_file.name}, 大小: {file_size} bytes")
+        logger.info("✅ 增强文本文件创建成功: %s, 大小: %d bytes", file_path, len(content))
 
-        return temp_file.name
+        return file_path
 
     except Exception as e:
-        print(f"❌ 增强文本导出失败: {e}")
+        logger.error("❌ 增强文本导出失败: %s", e)
         return None
 
 
 def export_with_smart_format(text):
-    """智能格式导出 - 优先文本，备用PDF"""
+    """智能格式导出 - 优先文本，备用PDF，返回 (文件路径, 状态信息)"""
     if not text or not text.strip():
-        return None, gr.update(value="❌ 没有内容可导出，请先生成剧本内容", visible=True)
+        return None, "❌ 没有内容可导出，请先生成剧本内容"
 
     try:
-        print("📄 开始智能格式导出...")
+        logger.debug("📄 开始智能格式导出...")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         word_count = count_words(text)
 
@@ -550,13 +919,13 @@ def export_with_smart_format(text):
 • 跨平台: VS Code、Sublime Text
 • 手机: 任何文本阅读器"""
 
-            return gr.update(value=text_file, visible=True), gr.update(value=success_msg, visible=True)
+            return text_file, success_msg
 
         # 文本导出失败时的备用处理
-        return None, gr.update(value="❌ 文本导出失败，请检查系统权限", visible=True)
+        return None, "❌ 文本导出失败，请检查系统权限"
 
     except Exception as e:
-        print(f"❌ 智能导出完全失败: {e}")
+        logger.error("❌ 智能导出完全失败: %s", e)
         error_msg = f"""❌ 导出过程出现错误
 🐛 错误信息: {str(e)[:100]}...
 💡 建议解决方案:
@@ -565,56 +934,84 @@ def export_with_smart_format(text):
 3. 尝试复制文本内容手动保存
 4. 联系技术支持: yuntongxu7@gmail.com"""
 
-        return None, gr.update(value=error_msg, visible=True)
+        return None, error_msg
+
+
+SIMHEI_FONT_PATH = 'simhei.ttf'
+
+
+def probe_simhei_font():
+    """检查SimHei字体文件是否可用（排除Git LFS指针文件）"""
+    if not os.path.exists(SIMHEI_FONT_PATH):
+        return False
+
+    try:
+        file_size = os.path.getsize(SIMHEI_FONT_PATH)
+        logger.info("📁 发现simhei.ttf，大小: %d bytes", file_size)
+
+        # 大于1MB才可能是真实字体
+        if file_size <= 1000000:
+            logger.warning("⚠️ 字体文件太小，可能是指针文件")
+            return False
+
+        # 检查是否为Git LFS指针文件
+        with open(SIMHEI_FONT_PATH, 'rb') as f:
+            header = f.read(100)
+        if b'version https://git-lfs.github.com' in header:
+            logger.warning("⚠️ 检测到Git LFS指针文件")
+            return False
+
+        return True
+    except Exception as e:
+        logger.error("❌ 字体检查失败: %s", e)
+        return False
+
+
+# 字体文件在运行期间不会变化，启动时检查一次
+SIMHEI_USABLE = probe_simhei_font()
+
+# 导出任务（PDF排版、文件写入）在线程池中执行，避免阻塞事件循环
+EXPORT_POOL = ThreadPoolExecutor(max_workers=2)
 
 
 def export_pdf_as_backup(text):
     """PDF导出作为备用方案"""
-    print("📄 尝试PDF备用导出...")
+    logger.info("📄 尝试PDF备用导出...")
     return export_pdf_with_status(text)
 
 
 def export_pdf_with_status(text):
-    """增强的PDF导出功能，返回文件和状态信息"""
+    """增强的PDF导出功能，返回 (文件路径, 状态信息)"""
     if not text or not text.strip():
-        return None, gr.update(value="❌ 没有内容可导出", visible=True)
+        return None, "❌ 没有内容可导出"
 
     try:
-        print("🔄 开始PDF导出...")
+        logger.debug("🔄 开始PDF导出...")
 
         # 关键步骤：预处理文本
         safe_text = clean_text_for_pdf(text)
+        # 统一转换为Latin-1安全文本，后续逐行输出无需再逐字符检查编码
+        safe_text = safe_text.encode('latin-1', errors='replace').decode('latin-1')
 
         # 创建PDF
         pdf = FPDF()
         pdf.add_page()
+        pdf.set_auto_page_break(auto=True, margin=15)
 
-        # 检查字体文件
+        # 字体文件是否可用已在启动时检查
         font_loaded = False
-        if os.path.exists('simhei.ttf'):
+        if SIMHEI_USABLE:
             try:
-                file_size = os.path.getsize('simhei.ttf')
-                print(f"📁 发现simhei.ttf，大小: {file_size} bytes")
-
-                # 检查是否为Git LFS指针文件
-                if file_size > 1000000:  # 大于1MB才可能是真实字体
-                    with open('simhei.ttf', 'rb') as f:
-                        header = f.read(100)
-                        if b'version https://git-lfs.github.com' not in header:
-                            pdf.add_font('SimHei', '', 'simhei.ttf', uni=True)
-                            pdf.set_font('SimHei', '', 10)
-                            font_loaded = True
-                            print("✅ SimHei字体加载成功")
-                        else:
-                            print("⚠️ 检测到Git LFS指针文件")
-                else:
-                    print("⚠️ 字体文件太小，可能是指针文件")
+                pdf.add_font('SimHei', '', SIMHEI_FONT_PATH, uni=True)
+                pdf.set_font('SimHei', '', 10)
+                font_loaded = True
+                logger.debug("✅ SimHei字体加载成功")
             except Exception as e:
-                print(f"❌ 字体加载失败: {e}")
+                logger.error("❌ 字体加载失败: %s", e)
 
         # 如果中文字体失败，使用Arial
         if not font_loaded:
-            print("🔤 使用ASCII模式，中文字符将被转换")
+            logger.debug("🔤 使用ASCII模式，中文字符将被转换")
             pdf.set_font('Arial', '', 10)
 
         # 添加标题
@@ -635,65 +1032,8 @@ def export_pdf_with_status(text):
             except:
                 pass
 
-        # 逐行添加内容
-        lines = safe_text.split('\n')
-        current_y = pdf.get_y()
-
-        for i, line in enumerate(lines):
-            # 检查页面空间
-            if current_y > 250:
-                pdf.add_page()
-                current_y = pdf.get_y()
-
-            try:
-                if line.strip():
-                    # 限制行长度
-                    max_length = 85
-                    if len(line) > max_length:
-                        # 分割长行
-                        words = line.split(' ')
-                        current_line = ""
-                        for word in words:
-                            if len(current_line + word + " ") <= max_length:
-                                current_line += word + " "
-                            else:
-                                if current_line.strip():
-                                    try:
-                                        current_line.encode('latin-1')
-                                        pdf.cell(0, 6, current_line.strip(), ln=True)
-                                    except UnicodeEncodeError:
-                                        safe_line = ''.join(c for c in current_line if ord(c) < 256)
-                                        pdf.cell(0, 6, safe_line.strip(), ln=True)
-                                    current_y += 6
-                                current_line = word + " "
-
-                        if current_line.strip():
-                            try:
-                                current_line.encode('latin-1')
-                                pdf.cell(0, 6, current_line.strip(), ln=True)
-                            except UnicodeEncodeError:
-                                safe_line = ''.join(c for c in current_line if ord(c) < 256)
-                                pdf.cell(0, 6, safe_line.strip(), ln=True)
-                            current_y += 6
-                    else:
-                        try:
-                            line.encode('latin-1')
-                            pdf.cell(0, 6, line, ln=True)
-                        except UnicodeEncodeError:
-                            safe_line = ''.join(c for c in line if ord(c) < 256)
-                            pdf.cell(0, 6, safe_line, ln=True)
-                        current_y += 6
-                else:
-                    pdf.ln(3)
-                    current_y += 3
-
-            except Exception as e:
-                print(f"⚠️ 处理第{i + 1}行时出错: {e}")
-                try:
-                    pdf.cell(0, 6, f"[Line {i + 1}: Processing Error]", ln=True)
-                    current_y += 6
-                except:
-                    pass
+        # 添加正文，由FPDF自动折行和分页
+        pdf.multi_cell(0, 6, safe_text)
 
         # 生成带时间戳的文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -708,7 +1048,7 @@ def export_pdf_with_status(text):
             # 验证文件
             if os.path.exists(temp_file.name) and os.path.getsize(temp_file.name) > 100:
                 file_size = os.path.getsize(temp_file.name)
-                print(f"✅ PDF生成成功: {file_size} bytes, 文件路径: {temp_file.name}")
+                logger.info("✅ PDF生成成功: %d bytes, 文件路径: %s", file_size, temp_file.name)
 
                 # 根据字体加载情况提供不同的状态消息
                 if font_loaded:
@@ -725,9 +1065,9 @@ def export_pdf_with_status(text):
 🔄 字符处理: 中文已转换为拼音/英文
 💡 建议: 如需完美中文显示，请使用文本导出"""
 
-                return gr.update(value=temp_file.name, visible=True), gr.update(value=success_msg, visible=True)
+                return temp_file.name, success_msg
             else:
-                print("❌ PDF文件无效")
+                logger.error("❌ PDF文件无效")
                 try:
                     os.unlink(temp_file.name)
                 except:
@@ -736,13 +1076,12 @@ def export_pdf_with_status(text):
                 # 使用增强文本导出作为备用
                 text_file = create_enhanced_text_export(text)
                 if text_file:
-                    return gr.update(value=text_file, visible=True), gr.update(value="📝 PDF生成失败，已自动生成文本格式",
-                                                                               visible=True)
+                    return text_file, "📝 PDF生成失败，已自动生成文本格式"
                 else:
-                    return None, gr.update(value="❌ PDF和文本导出都失败了", visible=True)
+                    return None, "❌ PDF和文本导出都失败了"
 
         except Exception as save_error:
-            print(f"❌ 保存PDF失败: {save_error}")
+            logger.error("❌ 保存PDF失败: %s", save_error)
             try:
                 os.unlink(temp_file.name)
             except:
@@ -751,162 +1090,189 @@ def export_pdf_with_status(text):
             # 使用增强文本导出作为备用
             text_file = create_enhanced_text_export(text)
             if text_file:
-                return gr.update(value=text_file, visible=True), gr.update(value="📝 PDF生成失败，已自动生成文本格式",
-                                                                           visible=True)
+                return text_file, "📝 PDF生成失败，已自动生成文本格式"
             else:
-                return None, gr.update(value=f"❌ 导出失败: {str(save_error)[:100]}...", visible=True)
+                return None, f"❌ 导出失败: {str(save_error)[:100]}..."
 
     except Exception as e:
-        print(f"❌ PDF导出完全失败: {e}")
+        logger.error("❌ PDF导出完全失败: %s", e)
 
         # 最后的备用方案
         text_file = create_enhanced_text_export(text)
         if text_file:
-            return gr.update(value=text_file, visible=True), gr.update(value="📝 PDF功能异常，已自动生成文本格式",
-                                                                       visible=True)
+            return text_file, "📝 PDF功能异常，已自动生成文本格式"
         else:
-            return None, gr.update(value=f"❌ 完全导出失败: {str(e)[:100]}...", visible=True)
+            return None, f"❌ 完全导出失败: {str(e)[:100]}..."
 
 
 # 创建全局角色管理器实例
 character_manager = CharacterManager()
 
 
-def build_ui():
-    """构建用户界面"""
-    # 启动时测试PDF功能
-    print("🚀 启动时测试导出功能...")
+def run_export_selftest():
+    """导出功能自检：分别测试文本与PDF导出并清理生成的测试文件"""
+    logger.info("🚀 启动时测试导出功能...")
     test_text = "测试文本：这是一个导出测试。\nTest text: This is an export test.\n测试中文字符处理能力。包含各种符号：！@#￥%……&*（）"
     try:
         # 测试文本导出
         text_result = export_with_smart_format(test_text)
-        if text_result[0] and text_result[0].value:
-            print(f"✅ 文本导出测试成功")
+        if text_result[0]:
+            logger.info("✅ 文本导出测试成功")
             # 清理测试文件
             try:
-                if os.path.exists(text_result[0].value):
-                    os.unlink(text_result[0].value)
-                    print("🧹 文本测试文件已清理")
+                if os.path.exists(text_result[0]):
+                    os.unlink(text_result[0])
+                    logger.debug("🧹 文本测试文件已清理")
             except:
                 pass
         else:
-            print("❌ 文本导出测试失败")
+            logger.error("❌ 文本导出测试失败")
 
         # 测试PDF导出
         pdf_result = export_pdf_with_status(test_text)
-        if pdf_result[0] and pdf_result[0].value:
-            print(f"✅ PDF导出测试成功")
+        if pdf_result[0]:
+            logger.info("✅ PDF导出测试成功")
             # 清理测试文件
             try:
-                if os.path.exists(pdf_result[0].value):
-                    os.unlink(pdf_result[0].value)
-                    print("🧹 PDF测试文件已清理")
+                if os.path.exists(pdf_result[0]):
+                    os.unlink(pdf_result[0])
+                    logger.debug("🧹 PDF测试文件已清理")
             except:
                 pass
         else:
-            print("⚠️ PDF导出测试失败，但有文本备用方案")
+            logger.warning("⚠️ PDF导出测试失败，但有文本备用方案")
 
     except Exception as e:
-        print(f"❌ 导出测试异常: {e}")
+        logger.error("❌ 导出测试异常: %s", e)
+
+
+# 创作示例（标题、角色、手动角色、风格、背景、提示、语气、创意度、字数）
+EXAMPLES = [
+    ["《未来迷城》", [], "艾拉（黑客）、机器人守卫（AI）", "科幻", "2050年赛博朋克城市",
+     "一场黑客入侵引发的连锁反应...", "冷峻科幻", 0.8, 300],
+    ["《校园奇遇》", [], "小明（学生）、神秘转校生（??）", "校园", "春天的樱花高中",
+     "转校生的真实身份让所有人震惊...", "青春活泼", 1.0, 250],
+    ["《古宅密码》", [], "探险家张博士（考古学家）、村民老王（向导）", "悬疑", "深山古宅，雷雨夜",
+     "一张神秘地图指向了埋藏百年的秘密...", "紧张悬疑", 0.9, 350]
+]
+
+
+# 页面标题
+TITLE_HTML = """
+<div class="title-text">
+    <h1 style="font-size: 3em; margin: 0;">🎭 剧境生成器 Pro</h1>
+    <p style="font-size: 1.2em; margin: 10px 0;">AI驱动的智能剧本创作平台 - 增强版</p>
+    <p>基于 DeepSeek 大模型，支持千帆ERNIE IRAG AI角色头像生成</p>
+    <p>📮 联系作者：<a href="mailto:yuntongxu7@gmail.com" style="color: #fff;">yuntongxu7@gmail.com</a></p>
+</div>
+"""
+
+# 界面样式
+CUSTOM_CSS = """
+.gradio-container {
+    max-width: 1400px !important;
+    margin: auto;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    padding: 20px;
+    border-radius: 15px;
+}
+.gr-box, .gr-form {
+    background: rgba(255, 255, 255, 0.95) !important;
+    border-radius: 10px !important;
+    backdrop-filter: blur(10px);
+    border: 1px solid rgba(255, 255, 255, 0.2) !important;
+    padding: 15px !important;
+    margin: 10px 0 !important;
+}
+.gr-button-primary {
+    background: linear-gradient(45deg, #667eea, #764ba2) !important;
+    border: none !important;
+    border-radius: 8px !important;
+    color: white !important;
+    font-weight: 600 !important;
+    transition: all 0.3s ease !important;
+}
+.gr-button-primary:hover {
+    transform: translateY(-2px) !important;
+    box-shadow: 0 5px 15px rgba(0,0,0,0.2) !important;
+}
+.gr-button-secondary {
+    background: linear-gradient(45deg, #f093fb, #f5576c) !important;
+    border: none !important;
+    border-radius: 8px !important;
+    color: white !important;
+    font-weight: 600 !important;
+}
+.character-image {
+    max-width: 300px;
+    max-height: 300px;
+    border-radius: 8px;
+    box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+}
+.refresh-button {
+    font-size: 18px;
+}
+.clear-button {
+    background-color: #f0f0f0;
+    border: 1px solid #ccc;
+}
+.clear-button:hover {
+    background-color: #e0e0e0;
+}
+.simple-divider {
+    text-align: center; 
+    color: #888; 
+    margin: 20px 0;
+    background: white;
+    border: none;
+}
+.title-text {
+    text-align: center;
+    color: white;
+    text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+    margin-bottom: 20px;
+}
+.pdf-status {
+    background: #f8f9fa !important;
+    border: 1px solid #e9ecef !important;
+    border-radius: 6px !important;
+    font-family: 'Monaco', 'Menlo', 'Ubuntu Mono', monospace !important;
+    font-size: 13px !important;
+}
+.pdf-output {
+    border: 2px dashed #007bff !important;
+    border-radius: 8px !important;
+    background: #f8f9fa !important;
+    padding: 15px !important;
+}
+"""
 
-    # 获取初始角色列表
-    initial_choices = character_manager.get_dropdown_choices()
-    print(f"🚀 界面启动：发现 {len(character_manager.characters)} 个角色")
-    if initial_choices:
-        print(f"🚀 初始角色选项: {initial_choices}")
-    else:
-        print("📝 当前没有角色，请先添加角色")
-
-    custom_css = """
-    .gradio-container {
-        max-width: 1400px !important;
-        margin: auto;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 20px;
-        border-radius: 15px;
-    }
-    .gr-box, .gr-form {
-        background: rgba(255, 255, 255, 0.95) !important;
-        border-radius: 10px !important;
-        backdrop-filter: blur(10px);
-        border: 1px solid rgba(255, 255, 255, 0.2) !important;
-        padding: 15px !important;
-        margin: 10px 0 !important;
-    }
-    .gr-button-primary {
-        background: linear-gradient(45deg, #667eea, #764ba2) !important;
-        border: none !important;
-        border-radius: 8px !important;
-        color: white !important;
-        font-weight: 600 !important;
-        transition: all 0.3s ease !important;
-    }
-    .gr-button-primary:hover {
-        transform: translateY(-2px) !important;
-        box-shadow: 0 5px 15px rgba(0,0,0,0.2) !important;
-    }
-    .gr-button-secondary {
-        background: linear-gradient(45deg, #f093fb, #f5576c) !important;
-        border: none !important;
-        border-radius: 8px !important;
-        color: white !important;
-        font-weight: 600 !important;
-    }
-    .character-image {
-        max-width: 300px;
-        max-height: 300px;
-        border-radius: 8px;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-    }
-    .refresh-button {
-        font-size: 18px;
-    }
-    .clear-button {
-        background-color: #f0f0f0;
-        border: 1px solid #ccc;
-    }
-    .clear-button:hover {
-        background-color: #e0e0e0;
-    }
-    .simple-divider {
-        text-align: center; 
-        color: #888; 
-        margin: 20px 0;
-        background: white;
-        border: none;
-    }
-    .title-text {
-        text-align: center;
-        color: white;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-        margin-bottom: 20px;
-    }
-    .pdf-status {
-        background: #f8f9fa !important;
-        border: 1px solid #e9ecef !important;
-        border-radius: 6px !important;
-        font-family: 'Monaco', 'Menlo', 'Ubuntu Mono', monospace !important;
-        font-size: 13px !important;
-    }
-    .pdf-output {
-        border: 2px dashed #007bff !important;
-        border-radius: 8px !important;
-        background: #f8f9fa !important;
-        padding: 15px !important;
-    }
-    """
 
-    with gr.Blocks(css=custom_css, title="剧境生成器 Pro") as demo:
-        gr.HTML("""
-        <div class="title-text">
-            <h1 style="font-size: 3em; margin: 0;">🎭 剧境生成器 Pro</h1>
-            <p style="font-size: 1.2em; margin: 10px 0;">AI驱动的智能剧本创作平台 - 增强版</p>
-            <p>基于 DeepSeek 大模型，支持千帆ERNIE IRAG AI角色头像生成</p>
-            <p>📮 联系作者：<a href="mailto:yuntongxu7@gmail.com" style="color: #fff;">yuntongxu7@gmail.com</a></p>
-        </div>
-        """)
+# 清空剧本表单时的默认值（标题、角色、风格、背景、提示、语气、手动角色、创意度、字数）
+CLEAR_DEFAULTS = ("", [], "", "", "", "", "", 0.9, 300)
+CLEAR_FORM_JS = f"() => {orjson.dumps(CLEAR_DEFAULTS).decode()}"
 
-        history_state = gr.State([])
+
+def build_ui():
+    """构建用户界面"""
+    # 启动自检较慢（字体加载、PDF生成、临时文件读写），仅在设置环境变量时执行
+    if os.getenv("PDG_STARTUP_SELFTEST"):
+        run_export_selftest()
+
+    logger.info("🚀 界面启动：发现 %d 个角色", len(character_manager.characters))
+    if not character_manager.characters:
+        logger.info("📝 当前没有角色，请先添加角色")
+
+    with gr.Blocks(css=CUSTOM_CSS, title="剧境生成器 Pro") as demo:
+        gr.HTML(TITLE_HTML)
+
+        # 历史记录：labels 为 标签→记录 的映射，order 为标签的生成顺序
+        history_state = gr.State({"labels": {}, "order": []})
+        export_result = gr.State(None)
+        # 最近一次生成结果的 (文本, 字数)，续写时若结果框内容未被修改则直接在此字数上累加
+        word_count_state = gr.State(None)
+        character_tab_opened = gr.State(False)
+        examples_opened = gr.State(False)
 
         with gr.Tabs():
             with gr.TabItem("🎬 剧本创作"):
@@ -918,7 +1284,7 @@ def build_ui():
                             with gr.Column(scale=4):
                                 character_dropdown = gr.Dropdown(
                                     label="从档案中选择角色（可多选）",
-                                    choices=initial_choices,
+                                    choices=[],
                                     multiselect=True,
                                     interactive=True,
                                     info="从已保存的角色档案中选择"
@@ -974,177 +1340,205 @@ def build_ui():
                             text_export_btn = gr.Button("📝 导出文本 (推荐)", variant="primary", size="lg")
                             pdf_export_btn = gr.Button("📄 导出PDF (备用)", variant="secondary", size="lg")
 
-                        with gr.Row():
-                            export_output = gr.File(
-                                label="📎 下载文件",
-                                visible=False,
-                                file_count="single",
-                                file_types=[".txt", ".pdf"],
+                        # 下载文件与导出状态在首次导出后才创建
+                        @gr.render(inputs=[export_result], triggers=[export_result.change])
+                        def render_export_result(result):
+                            """渲染导出结果"""
+                            if not result:
+                                return
+                            file_path, status = result
+                            if file_path:
+                                with gr.Row():
+                                    gr.File(
+                                        value=file_path,
+                                        label="📎 下载文件",
+                                        file_count="single",
+                                        file_types=[".txt", ".pdf"],
+                                        interactive=False,
+                                        elem_classes="pdf-output"
+                                    )
+
+                            gr.Textbox(
+                                value=status,
+                                label="📋 导出状态",
                                 interactive=False,
-                                elem_classes="pdf-output"
+                                lines=4,
+                                elem_classes="pdf-status"
                             )
 
-                        export_status = gr.Textbox(
-                            label="📋 导出状态",
-                            interactive=False,
-                            visible=False,
-                            lines=4,
-                            placeholder="等待导出...",
-                            elem_classes="pdf-status"
-                        )
-
-            with gr.TabItem("👤 角色档案管理"):
-                with gr.Row():
-                    with gr.Column(scale=2):
-                        gr.Markdown("### ✏️ 角色信息")
-
-                        # 角色信息输入
-                        char_inputs = [
-                            gr.Textbox(label="角色姓名", placeholder="角色的姓名"),
-                            gr.Textbox(label="角色类型", placeholder="如：主角、反派、配角等"),
-                            gr.Textbox(label="年龄", placeholder="如：25岁"),
-                            gr.Textbox(label="外貌特征", lines=2, placeholder="身高、体型、特征等"),
-                            gr.Textbox(label="性格特点", lines=2, placeholder="性格特点描述"),
-                            gr.Textbox(label="背景故事", lines=3, placeholder="成长经历、职业等"),
-                            gr.Textbox(label="习惯/特点", lines=2, placeholder="如：说话方式、小动作等"),
-                            gr.Textbox(label="与其他角色关系", lines=2, placeholder="与主要角色的关系")
-                        ]
-
-                        character_name, role_type, age, appearance, personality, background_story, habits, relationships = char_inputs
+            with gr.TabItem("👤 角色档案管理") as character_tab:
+                # 角色管理界面组件较多，首次切换到该标签页时才创建并绑定事件
+                @gr.render(inputs=[character_tab_opened], triggers=[character_tab_opened.change])
+                def render_character_tab(opened):
+                    """渲染角色档案管理界面"""
+                    if not opened:
+                        return
+
+                    with gr.Row():
+                        with gr.Column(scale=2):
+                            gr.Markdown("### ✏️ 角色信息")
+
+                            # 角色信息输入（姓名、类型、年龄、外貌、性格、背景故事、习惯、人物关系）
+                            char_json = gr.Code(label="角色信息", language="json", value=EMPTY_CHARACTER_JSON,
+                                                interactive=True)
+
+                            with gr.Row():
+                                add_character_btn = gr.Button("➕ 添加角色", variant="primary")
+                                update_character_btn = gr.Button("✏️ 更新角色", variant="secondary")
+                                delete_character_btn = gr.Button("🗑️ 删除角色", variant="stop")
+
+                            with gr.Row():
+                                clear_form_btn = gr.Button("🧹 清空表单", elem_classes="clear-button")
+
+                            # 图片生成区域（不常用，默认折叠）
+                            with gr.Accordion("🎨 角色头像生成", open=False):
+                                gr.Markdown("**使用千帆ERNIE IRAG进行AI绘画，支持中文描述**")
+                                generate_image_btn = gr.Button("🎨 生成角色头像", variant="secondary", size="lg")
+                                regenerate_image_btn = gr.Button("🔁 重新生成头像（不使用缓存）", variant="secondary")
+                                generate_all_images_btn = gr.Button("🖼️ 批量生成全部头像", variant="secondary")
+
+                            character_index = gr.Number(label="编辑角色索引", visible=False, value=-1, precision=0)
+                            message_box = gr.Textbox(label="操作提示", interactive=False, visible=False)
+
+                        with gr.Column(scale=2):
+                            gr.Markdown("### 📋 角色列表")
+
+                            character_list = gr.Dropdown(
+                                label="选择角色",
+                                choices=character_manager.get_dropdown_choices(),
+                                interactive=True
+                            )
 
-                        with gr.Row():
-                            add_character_btn = gr.Button("➕ 添加角色", variant="primary")
-                            update_character_btn = gr.Button("✏️ 更新角色", variant="secondary")
-                            delete_character_btn = gr.Button("🗑️ 删除角色", variant="stop")
+                            character_image = gr.Image(
+                                label="角色头像",
+                                type="filepath",
+                                elem_classes="character-image",
+                                show_label=True,
+                                interactive=False
+                            )
 
-                        with gr.Row():
-                            clear_form_btn = gr.Button("🧹 清空表单", elem_classes="clear-button")
+                            character_preview = gr.Textbox(
+                                label="角色档案预览",
+                                lines=10,
+                                interactive=False
+                            )
 
-                        # 图片生成区域
-                        gr.Markdown("### 🎨 角色头像生成")
-                        gr.Markdown("**使用千帆ERNIE IRAG进行AI绘画，支持中文描述**")
-                        generate_image_btn = gr.Button("🎨 生成角色头像", variant="secondary", size="lg")
+                            refresh_btn = gr.Button("🔄 刷新角色列表")
 
-                        character_index = gr.Number(label="编辑角色索引", visible=False, value=-1)
-                        message_box = gr.Textbox(label="操作提示", interactive=False, visible=False)
+                    # === 角色管理事件绑定 ===
 
-                    with gr.Column(scale=2):
-                        gr.Markdown("### 📋 角色列表")
+                    # 定义输出组件顺序
+                    char_outputs = [character_dropdown, character_list, char_json, character_index, character_preview,
+                                    message_box]
 
-                        character_list = gr.Dropdown(
-                            label="选择角色",
-                            choices=initial_choices,
-                            interactive=True
-                        )
+                    # 角色管理事件
+                    char_inputs = [character_index, char_json]
+                    add_character_btn.click(partial(char_action, "add"), char_inputs, char_outputs)
+                    update_character_btn.click(partial(char_action, "update"), char_inputs, char_outputs)
+                    delete_character_btn.click(partial(char_action, "delete"), char_inputs, char_outputs)
+                    clear_form_btn.click(clear_form, [], [char_json, character_index, character_preview, message_box])
 
-                        character_image = gr.Image(
-                            label="角色头像",
-                            elem_classes="character-image",
-                            show_label=True,
-                            interactive=False
-                        )
+                    # 刷新事件
+                    refresh_btn.click(update_dropdowns, [], [character_dropdown, character_list])
 
-                        character_preview = gr.Textbox(
-                            label="角色档案预览",
-                            lines=10,
-                            interactive=False
-                        )
+                    # 角色选择事件（快速连续切换时只加载最后选中的角色）
+                    character_list.change(
+                        load_character_with_image,
+                        [character_list],
+                        [char_json, character_index, character_preview, message_box, character_image],
+                        trigger_mode="always_last",
+                        show_progress="hidden"
+                    )
 
-                        refresh_btn = gr.Button("🔄 刷新角色列表")
+                    # 图片生成事件
+                    image_outputs = [character_image, message_box, character_dropdown, character_list]
+                    generate_image_btn.click(generate_image_handler, [character_index], image_outputs)
+                    regenerate_image_btn.click(partial(generate_image_handler, regenerate=True), [character_index],
+                                               image_outputs)
+                    generate_all_images_btn.click(generate_all_images_handler, [], [message_box])
 
         # === 事件处理函数 ===
 
         def update_dropdowns():
-            """更新角色下拉菜单"""
+            """更新角色下拉菜单（选项列表由 CharacterManager 缓存，更新字典每次新建，Gradio 处理时会修改它）"""
             choices = character_manager.get_dropdown_choices()
-            print(f"🔄 更新下拉菜单，当前选项: {choices}")
             return [gr.update(choices=choices, value=None), gr.update(choices=choices, value=None)]
 
         def clear_form():
             """清空表单"""
-            return [""] * 8 + [-1, "", gr.update(visible=False)]
+            return [EMPTY_CHARACTER_JSON, -1, "", gr.update(visible=False)]
 
         def show_message(msg, is_error=False):
             """显示操作消息"""
             return gr.update(value=f"{'❌' if is_error else '✅'} {msg}", visible=True)
 
         # 角色管理事件处理
-        def add_character_handler(*inputs):
-            """添加角色处理函数"""
-            name, role_type = inputs[0].strip(), inputs[1].strip()
-
+        def char_action(action, index, text):
+            """角色增删改处理函数（action 为 "add"、"update" 或 "delete"）"""
+            if action == "delete":
+                if index == -1:
+                    return update_dropdowns() + [EMPTY_CHARACTER_JSON, -1, "",
+                                                 show_message("请先选择要删除的角色", True)]
+
+                char_name = character_manager.characters[index]['name']
+                character_manager.delete_character(index)
+                return update_dropdowns() + [EMPTY_CHARACTER_JSON, -1, "",
+                                             show_message(f"角色 '{char_name}' 删除成功！")]
+
+            if action == "update" and index == -1:
+                return update_dropdowns() + [text, index, "", show_message("请先选择要更新的角色", True)]
+
+            # 校验失败时保留表单内容，更新操作同时保留当前编辑的角色索引
+            kept_index = index if action == "update" else -1
+            char_data, error = parse_character_json(text)
+            if error:
+                return update_dropdowns() + [text, kept_index, "", show_message(error, True)]
+
+            name, role_type = char_data['name'], char_data['role_type']
             if not name:
-                return update_dropdowns() + list(inputs) + [-1, "", show_message("角色姓名不能为空", True)]
-
-            if character_manager.character_exists(name, role_type):
-                return update_dropdowns() + list(inputs) + [-1, "",
-                                                            show_message(f"角色 '{name} ({role_type})' 已存在", True)]
-
-            char_data = {key: val.strip() for key, val in zip(
-                ['name', 'role_type', 'age', 'appearance', 'personality', 'background_story', 'habits',
-                 'relationships'],
-                inputs
-            )}
+                return update_dropdowns() + [text, kept_index, "", show_message("角色姓名不能为空", True)]
 
-            character_manager.add_character(char_data)
-            return update_dropdowns() + [""] * 8 + [-1, "", show_message(f"角色 '{name}' 添加成功！")]
+            if action == "add":
+                if character_manager.character_exists(name, role_type):
+                    return update_dropdowns() + [text, -1, "",
+                                                 show_message(f"角色 '{name} ({role_type})' 已存在", True)]
 
-        def update_character_handler(index, *inputs):
-            """更新角色处理函数"""
-            if index == -1:
-                return update_dropdowns() + list(inputs) + [index, "", show_message("请先选择要更新的角色", True)]
-
-            name = inputs[0].strip()
-            if not name:
-                return update_dropdowns() + list(inputs) + [index, "", show_message("角色姓名不能为空", True)]
-
-            char_data = {key: val.strip() for key, val in zip(
-                ['name', 'role_type', 'age', 'appearance', 'personality', 'background_story', 'habits',
-                 'relationships'],
-                inputs
-            )}
+                character_manager.add_character(char_data)
+                return update_dropdowns() + [EMPTY_CHARACTER_JSON, -1, "",
+                                             show_message(f"角色 '{name}' 添加成功！")]
 
             character_manager.update_character(index, char_data)
-            return update_dropdowns() + [""] * 8 + [-1, "", show_message(f"角色 '{name}' 更新成功！")]
+            return update_dropdowns() + [EMPTY_CHARACTER_JSON, -1, "", show_message(f"角色 '{name}' 更新成功！")]
 
-        def delete_character_handler(index):
-            """删除角色处理函数"""
-            if index == -1:
-                return update_dropdowns() + [""] * 8 + [-1, "", show_message("请先选择要删除的角色", True)]
-
-            char_name = character_manager.characters[index]['name']
-            character_manager.delete_character(index)
-            return update_dropdowns() + [""] * 8 + [-1, "", show_message(f"角色 '{char_name}' 删除成功！")]
-
-        def load_character_with_image(character_name):
+        def load_character_with_image(char_index):
             """加载角色信息并显示图片"""
-            print(f"🔍 尝试加载角色: {character_name}")
+            logger.debug("🔍 尝试加载角色: %s", char_index)
 
-            if not character_name:
-                return [""] * 8 + [-1, "请选择角色", gr.update(visible=False), None]
+            if char_index is None:
+                return [EMPTY_CHARACTER_JSON, -1, "请选择角色", gr.update(visible=False), None]
 
-            try:
-                char_index = int(character_name.split(":")[0])
-                print(f"🔍 解析角色索引: {char_index}")
+            if 0 <= char_index < len(character_manager.characters):
+                char = character_manager.characters[char_index]
+                logger.debug("✅ 成功加载角色: %s", char['name'])
 
-                if 0 <= char_index < len(character_manager.characters):
-                    char = character_manager.characters[char_index]
-                    print(f"✅ 成功加载角色: {char['name']}")
-
-                    formatted = ROLE_TEMPLATE.format(**char)
-                    image = get_character_image(char_index)
-                    return list(char.values())[:-1] + [char_index, formatted, gr.update(visible=False), image]
-                else:
-                    print(f"❌ 角色索引超出范围: {char_index} >= {len(character_manager.characters)}")
-            except (ValueError, IndexError) as e:
-                print(f"❌ 解析角色失败: {e}")
+                formatted = format_character(char)
+                image = get_character_image(char_index)
+                return [character_to_json(char), char_index, formatted, gr.update(visible=False), image]
+            else:
+                logger.warning("❌ 角色索引超出范围: %s >= %d", char_index, len(character_manager.characters))
 
-            return [""] * 8 + [-1, "未找到角色", gr.update(visible=False), None]
+            return [EMPTY_CHARACTER_JSON, -1, "未找到角色", gr.update(visible=False), None]
 
         # 图片生成事件
-        def generate_image_handler(character_index):
+        async def generate_image_handler(character_index, regenerate=False):
             """生成头像处理函数"""
-            image, message = generate_character_image(character_index)
+            if character_index == -1:
+                image, message = None, "请先选择角色"
+            elif not 0 <= character_index < len(character_manager.characters):
+                image, message = None, "角色索引无效"
+            else:
+                character = character_manager.characters[character_index]
+                image, message = await generate_character_image(character, regenerate)
             is_error = "失败" in message or "出错" in message
             return (
                 image,
@@ -1152,71 +1546,96 @@ def build_ui():
                 *update_dropdowns()
             )
 
+        async def generate_all_images_handler(progress=gr.Progress()):
+            """批量生成头像处理函数"""
+            if not character_manager.characters:
+                return show_message("当前没有角色，请先添加角色", True)
+
+            success_count, total = await generate_all_character_images(progress)
+            failed_count = total - success_count
+            return show_message(f"批量生成完成：成功 {success_count} 个，失败 {failed_count} 个", failed_count > 0)
+
         # 剧本生成事件
-        def generate_with_history(*args):
-            """生成剧本并保存历史"""
-            script = generate_script(*args[:-1])
+        async def generate_with_history(*args):
+            """生成剧本并保存历史（生成过程中实时显示已生成内容）"""
+            history = args[-1] if isinstance(args[-1], dict) else {"labels": {}, "order": []}
+
+            # 生成过程中只更新正文（标题按字数区间更新），时间与历史记录在生成结束后更新
+            script = ""
+            word_count = 0
+            async for new_script in generate_script(*args[:-1]):
+                # 流式输出只在末尾追加内容，只需统计新增部分的字数
+                previous_step = word_count // LABEL_UPDATE_STEP
+                word_count += count_words(new_script[len(script):])
+                script = new_script
+                if word_count // LABEL_UPDATE_STEP != previous_step:
+                    update = gr.update(value=script, label=OUTPUT_LABEL_FMT(word_count))
+                else:
+                    update = gr.update(value=script)
+                yield update, gr.skip(), gr.skip(), gr.skip(), gr.skip()
+
             timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # 字数限制可能截断最终结果，重新统计一次
             word_count = count_words(script)
 
-            history = args[-1] if isinstance(args[-1], list) else []
             label = f"{timestamp_str}（{word_count}字中文）"
-            history.append({"label": label, "text": script, "word_count": word_count})
+            if label not in history["labels"]:
+                history["order"].append(label)
+            history["labels"][label] = {"text": script, "word_count": word_count}
 
-            output_label = f"📖 生成结果 ({word_count} 字中文)"
-
-            return (
-                gr.update(value=script, label=output_label),
+            yield (
+                gr.update(value=script, label=OUTPUT_LABEL_FMT(word_count)),
                 timestamp_str,
                 history,
-                gr.update(choices=[item["label"] for item in history])
+                gr.update(choices=history["order"]),
+                (script, word_count)
             )
 
-        def continue_script(text, temperature, word_limit):
-            """续写剧本"""
-            continuation = generate_script("", [], "", "", "", text, "", temperature, word_limit, append=True)
+        async def continue_script(text, counted, temperature, word_limit):
+            """续写剧本（续写过程中实时显示已生成内容）"""
+            continuation = ""
+            # 结果框内容与记录的文本一致时复用已有字数，用户手动编辑过才重新统计
+            counted_text, counted_words = counted or (None, 0)
+            base_count = counted_words if counted_text == text else count_words(text)
+            added_count = 0
+            async for new_continuation in generate_script("", [], "", "", "", text, "", temperature, word_limit,
+                                                          append=True):
+                previous_step = (base_count + added_count) // LABEL_UPDATE_STEP
+                added_count += count_words(new_continuation[len(continuation):])
+                continuation = new_continuation
+                word_count = base_count + added_count
+                if word_count // LABEL_UPDATE_STEP != previous_step:
+                    update = gr.update(value=text + "\n\n" + continuation, label=OUTPUT_LABEL_FMT(word_count))
+                else:
+                    update = gr.update(value=text + "\n\n" + continuation)
+                yield update, gr.skip(), gr.skip()
+
+            # 已有内容的字数不变，只需统计最终续写部分（字数限制可能截断续写结果）
             full_text = text + "\n\n" + continuation
-            word_count = count_words(full_text)
-            output_label = f"📖 生成结果 ({word_count} 字中文)"
-            return gr.update(value=full_text, label=output_label), datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            word_count = base_count + count_words(continuation)
+            yield (gr.update(value=full_text, label=OUTPUT_LABEL_FMT(word_count)),
+                   datetime.now().strftime("%Y-%m-%d %H:%M:%S"), (full_text, word_count))
 
         def restore_history(choice_label, history, current_text):
             """从历史记录恢复"""
-            for item in history:
-                if item["label"] == choice_label:
-                    word_count = count_words(item["text"])
-                    output_label = f"📖 生成结果 ({word_count} 字中文)"
-                    return gr.update(value=item["text"], label=output_label)
-            return gr.update(value=current_text)
+            item = history["labels"].get(choice_label)
+            if item is None:
+                return gr.update(value=current_text), gr.skip()
+            return (gr.update(value=item["text"], label=OUTPUT_LABEL_FMT(item["word_count"])),
+                    (item["text"], item["word_count"]))
 
         # === 事件绑定 ===
 
-        # 定义输出组件顺序
-        char_outputs = [character_dropdown, character_list] + char_inputs + [character_index, character_preview,
-                                                                             message_box]
-
-        # 角色管理事件
-        add_character_btn.click(add_character_handler, char_inputs, char_outputs)
-        update_character_btn.click(update_character_handler, [character_index] + char_inputs, char_outputs)
-        delete_character_btn.click(delete_character_handler, [character_index], char_outputs)
-        clear_form_btn.click(clear_form, [], char_inputs + [character_index, character_preview, message_box])
-
-        # 刷新事件
-        for btn in [refresh_char_btn, refresh_btn]:
-            btn.click(update_dropdowns, [], [character_dropdown, character_list])
-
-        # 角色选择事件
-        character_list.change(
-            load_character_with_image,
-            [character_list],
-            char_inputs + [character_index, character_preview, message_box, character_image]
-        )
+        # 角色档案管理标签页首次打开时才渲染
+        character_tab.select(lambda: True, [], [character_tab_opened])
 
-        # 图片生成事件
-        generate_image_btn.click(
-            generate_image_handler,
-            [character_index],
-            [character_image, message_box, character_dropdown, character_list]
+        # 刷新事件：页面加载后填充角色选项（不阻塞首屏），与刷新按钮共用同一个处理函数
+        # （角色列表位于延迟渲染的标签页内，由其自身的刷新按钮更新）
+        gr.on(
+            triggers=[demo.load, refresh_char_btn.click],
+            fn=lambda: update_dropdowns()[0],
+            inputs=[],
+            outputs=[character_dropdown]
         )
 
         # 剧本生成事件
@@ -1224,62 +1643,78 @@ def build_ui():
             generate_with_history,
             [title, character_dropdown, manual_roles, style, background, prompt, tone, temperature, word_limit,
              history_state],
-            [output, timestamp, history_state, history_dropdown]
+            [output, timestamp, history_state, history_dropdown, word_count_state],
+            concurrency_limit=GENERATION_CONCURRENCY,
+            concurrency_id="generation"
         )
 
-        continue_button.click(continue_script, [output, temperature, word_limit], [output, timestamp])
-        restore_button.click(restore_history, [history_dropdown, history_state, output], [output])
+        continue_button.click(continue_script, [output, word_count_state, temperature, word_limit],
+                              [output, timestamp, word_count_state], concurrency_limit=GENERATION_CONCURRENCY,
+                              concurrency_id="generation")
+        restore_button.click(restore_history, [history_dropdown, history_state, output], [output, word_count_state])
 
+        # 清空表单完全在浏览器端完成，无需请求服务器
         clear.click(
-            lambda: ["", [], "", "", "", "", "", 0.9, 300],
-            [], [title, character_dropdown, style, background, prompt, tone, manual_roles, temperature, word_limit]
+            None,
+            [], [title, character_dropdown, style, background, prompt, tone, manual_roles, temperature, word_limit],
+            js=CLEAR_FORM_JS
         )
 
-        def safe_export_handler(text, export_type="text"):
-            """安全的导出处理函数"""
+        async def safe_export_handler(text, export_type="text"):
+            """安全的导出处理函数，返回 (文件路径, 状态信息)"""
             if not text or not text.strip():
-                return None, gr.update(value="❌ 没有内容可导出，请先生成剧本内容", visible=True)
+                return None, "❌ 没有内容可导出，请先生成剧本内容"
 
-            print(f"📄 开始处理{export_type}导出，内容长度: {len(text)} 字符")
+            logger.debug("📄 开始处理%s导出，内容长度: %d 字符", export_type, len(text))
 
             try:
                 if export_type == "text":
-                    return export_with_smart_format(text)
+                    export_func = export_with_smart_format
                 elif export_type == "pdf":
-                    return export_pdf_with_status(text)
+                    export_func = export_pdf_with_status
                 else:
-                    return None, gr.update(value="❌ 未知的导出类型", visible=True)
+                    return None, "❌ 未知的导出类型"
+                return await asyncio.get_running_loop().run_in_executor(EXPORT_POOL, export_func, text)
             except Exception as e:
                 error_msg = f"❌ 导出过程中发生错误: {str(e)[:150]}..."
-                print(f"❌ {export_type}导出异常: {e}")
-                return None, gr.update(value=error_msg, visible=True)
+                logger.error("❌ %s导出异常: %s", export_type, e)
+                return None, error_msg
 
         # 导出事件绑定
+        # 导出在线程池中执行，不占用队列并发名额
         text_export_btn.click(
-            lambda text: safe_export_handler(text, "text"),
+            partial(safe_export_handler, export_type="text"),
             [output],
-            [export_output, export_status]
+            [export_result],
+            concurrency_limit=None
         )
 
         pdf_export_btn.click(
-            lambda text: safe_export_handler(text, "pdf"),
+            partial(safe_export_handler, export_type="pdf"),
             [output],
-            [export_output, export_status]
+            [export_result],
+            concurrency_limit=None
         )
 
         # 示例数据
-        gr.Examples(
-            label="💡 创作示例（点击可一键填入）",
-            examples=[
-                ["《未来迷城》", [], "艾拉（黑客）、机器人守卫（AI）", "科幻", "2050年赛博朋克城市",
-                 "一场黑客入侵引发的连锁反应...", "冷峻科幻", 0.8, 300],
-                ["《校园奇遇》", [], "小明（学生）、神秘转校生（??）", "校园", "春天的樱花高中",
-                 "转校生的真实身份让所有人震惊...", "青春活泼", 1.0, 250],
-                ["《古宅密码》", [], "探险家张博士（考古学家）、村民老王（向导）", "悬疑", "深山古宅，雷雨夜",
-                 "一张神秘地图指向了埋藏百年的秘密...", "紧张悬疑", 0.9, 350]
-            ],
-            inputs=[title, character_dropdown, manual_roles, style, background, prompt, tone, temperature, word_limit]
-        )
+        # 示例在首次展开折叠面板时才创建，避免首屏加载全部示例行
+        with gr.Accordion("💡 创作示例", open=False) as examples_accordion:
+            @gr.render(inputs=[examples_opened], triggers=[examples_opened.change])
+            def render_examples(opened):
+                """渲染创作示例"""
+                if not opened:
+                    return
+                gr.Examples(
+                    label="点击可一键填入",
+                    examples=EXAMPLES,
+                    inputs=[title, character_dropdown, manual_roles, style, background, prompt, tone, temperature,
+                            word_limit]
+                )
+
+        examples_accordion.expand(lambda: True, [], [examples_opened])
+
+    # 异步处理函数在等待API时让出事件循环，允许多个用户的请求并发执行
+    demo.queue(default_concurrency_limit=8, max_size=32)
 
     return demo
 